@@ -0,0 +1,374 @@
+# app-fastest.py
+import asyncio
+import os
+import sqlite3
+import threading
+import google.generativeai as genai
+import httpx
+import orjson
+from groq import AsyncGroq
+from jinja2 import Template
+from quart import Quart, request, Response
+
+# --- Configuration ---
+# This app sends every page request to Gemini, Groq and Inception Labs at the
+# same time and serves whichever page comes back first. Set the API keys as
+# environment variables; providers without a key are left out of the race.
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
+INCEPTION_API_KEY = os.environ.get("INCEPTION_API_KEY", "")
+
+if not (GOOGLE_API_KEY or GROQ_API_KEY or INCEPTION_API_KEY):
+    print("ERROR: No API key is set.")
+    print("Please set at least one of GOOGLE_API_KEY, GROQ_API_KEY or INCEPTION_API_KEY.")
+    exit()
+
+# The models raced against each other
+GEMINI_MODEL_NAME = "gemini-2.5-pro"
+GROQ_MODEL_NAME = "qwen2.5-72b-instruct"
+MERCURY_MODEL_NAME = "mercury-coder"
+
+# The part of the Mercury request body that is the same for every page
+_MERCURY_PAYLOAD_STATIC = {'model': MERCURY_MODEL_NAME, 'max_tokens': 2000}
+
+# Initialize the Quart app
+app = Quart(__name__)
+
+# The system prompt used until a new one is set through /change-prompt
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a professional web developer. Your task is to generate complete, "
+    "modern, and well-structured HTML for a web page based on the user's request. "
+    "You must include the full HTML structure, including <!DOCTYPE html>, <html>, "
+    "<head>, and <body> tags. Use Tailwind CSS for styling by including the "
+    "official Tailwind CDN link in the <head> section. Always include clickable "
+    "buttons and navigation links to other pages. Make sure all buttons are functional "
+    "and lead to relevant pages."
+)
+
+# --- System Prompt Store ---
+# The current system prompt lives in a one-element list, so replacing or reading
+# _prompt_holder[0] is a single atomic step that needs no lock. Updates are also
+# written to a small SQLite database, which lets the other worker processes
+# (and the next restart) pick them up; the database is only read again after
+# another worker has written to it.
+SITE_DB = os.environ.get("SITE_DB", "site.db")
+_DB = sqlite3.connect(SITE_DB, isolation_level=None, check_same_thread=False)
+_DB.execute("CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT)")
+_db_lock = threading.Lock()
+# Writes go through a connection of their own, so a write waiting on another
+# worker's never holds _db_lock and stalls the reads requests make on _DB
+_WRITE_DB = sqlite3.connect(SITE_DB, isolation_level=None, check_same_thread=False)
+_write_lock = threading.Lock()
+_PROMPT_SETTING = "system_prompt:fastest"
+_prompt_holder = [DEFAULT_SYSTEM_PROMPT]
+# PRAGMA data_version changes whenever another connection commits to the database
+_db_version = [None]
+
+
+def refresh_system_prompt():
+    """Picks up a system prompt set by another worker and returns the current one."""
+    with _db_lock:
+        (version,) = _DB.execute("PRAGMA data_version").fetchone()
+        if version != _db_version[0]:
+            _db_version[0] = version
+            row = _DB.execute("SELECT v FROM settings WHERE k = ?", (_PROMPT_SETTING,)).fetchone()
+            if row is not None:
+                _prompt_holder[0] = row[0]
+    return _prompt_holder[0]
+
+
+def set_system_prompt(prompt):
+    """Replaces the system prompt for this worker and every other one."""
+    _prompt_holder[0] = prompt
+    with _write_lock:
+        _WRITE_DB.execute("INSERT OR REPLACE INTO settings (k, v) VALUES (?, ?)", (_PROMPT_SETTING, prompt))
+
+
+refresh_system_prompt()
+
+# --- Provider Clients ---
+# Instructions for clean output, sent after the system prompt
+_OUTPUT_INSTRUCTIONS = "Generate ONLY complete, functional HTML code. Do not include any explanations, comments, or text before/after the HTML. Start directly with <!DOCTYPE html> and end with </html>. No markdown formatting.\n\n---USER REQUEST---\n"
+
+genai.configure(api_key=GOOGLE_API_KEY)
+_GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME)
+_GEMINI_CONFIG = genai.types.GenerationConfig(
+    temperature=0.8,
+    top_p=0.95,
+    top_k=64,
+    max_output_tokens=4000,
+)
+
+_GROQ = AsyncGroq(api_key=GROQ_API_KEY)
+
+# Shared HTTP client so connections to Inception Labs are reused
+_HTTP = httpx.AsyncClient(
+    timeout=120.0,
+    headers={
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {INCEPTION_API_KEY}'
+    },
+)
+
+
+@app.after_serving
+async def close_http_client():
+    """Closes the pooled connections when the server shuts down."""
+    await _HTTP.aclose()
+
+
+async def _generate_with_gemini(full_prompt):
+    """Returns the raw text Gemini generates for a prompt."""
+    response = await _GEMINI_MODEL.generate_content_async(full_prompt, generation_config=_GEMINI_CONFIG)
+    return response.text
+
+
+async def _generate_with_groq(full_prompt):
+    """Returns the raw text Groq generates for a prompt."""
+    chat_completion = await _GROQ.chat.completions.create(
+        messages=[{"role": "user", "content": full_prompt}],
+        model=GROQ_MODEL_NAME,
+        max_tokens=4000,
+        temperature=0.8
+    )
+    return chat_completion.choices[0].message.content
+
+
+async def _generate_with_mercury(full_prompt):
+    """Returns the raw text Inception Labs Mercury generates for a prompt."""
+    response = await _HTTP.post(
+        'https://api.inceptionlabs.ai/v1/chat/completions',
+        content=orjson.dumps({
+            **_MERCURY_PAYLOAD_STATIC,
+            'messages': [
+                {'role': 'user', 'content': full_prompt}
+            ]
+        })
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)['choices'][0]['message']['content']
+
+
+# Only the providers with an API key take part
+_PROVIDERS = [
+    (name, generate)
+    for name, key, generate in (
+        ("Google Gemini", GOOGLE_API_KEY, _generate_with_gemini),
+        ("Groq", GROQ_API_KEY, _generate_with_groq),
+        ("Inception Labs", INCEPTION_API_KEY, _generate_with_mercury),
+    )
+    if key
+]
+print(f"Racing providers: {', '.join(name for name, _ in _PROVIDERS)}")
+
+# --- HTML Cleanup ---
+def _strip_to_html(text):
+    """
+    Strips any explanatory text before the HTML and any markdown fences.
+
+    Args:
+        text (str): Raw text produced by the model.
+
+    Returns:
+        str: The cleaned HTML.
+    """
+    # Find where the document starts and slice once, instead of splitting and rejoining
+    start = text.find('<!DOCTYPE')
+    if start < 0:
+        start = text.find('<html')
+    if start > 0:
+        text = text[start:]
+    
+    # Only walk the text again when there is a fence to remove
+    if '`' in text:
+        text = text.replace('```html', '').replace('```', '')
+    
+    return text
+
+
+# --- Helper Function for LLM Interaction ---
+async def generate_html_with_fastest_llm(page_prompt):
+    """
+    Sends a prompt to every configured provider at once and keeps the first page.
+
+    Providers that fail are ignored as long as another one is still running;
+    the rest are cancelled as soon as one of them succeeds.
+
+    Args:
+        page_prompt (str): The prompt describing the page to generate.
+
+    Returns:
+        str: The generated HTML content, or an error message.
+    """
+    full_prompt = refresh_system_prompt() + "\n\n" + _OUTPUT_INSTRUCTIONS + page_prompt
+    tasks = {asyncio.create_task(generate(full_prompt)): name for name, generate in _PROVIDERS}
+    pending = set(tasks)
+    errors = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    text = task.result()
+                    # A provider may answer with no content at all
+                    generated_html = _strip_to_html(text.strip()) if text else ''
+                    if not generated_html:
+                        raise ValueError("empty response")
+                except Exception as e:
+                    print(f"An unexpected error occurred with the {tasks[task]} API: {e}")
+                    errors.append(f"{tasks[task]}: {e}")
+                    continue
+                print(f"{tasks[task]} finished first")
+                return generated_html
+    finally:
+        # Stop the providers that lost the race
+        for task in pending:
+            task.cancel()
+    
+    error_list = "".join(f"<li>{error}</li>" for error in errors)
+    return f"<h1>Error: Every LLM provider failed</h1><ul>{error_list}</ul>"
+
+
+# --- Change Prompt Pages ---
+# The form is compiled once; autoescaping keeps a prompt containing markup such
+# as </textarea> from breaking out of the text box.
+_PROMPT_FORM_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>Change System Prompt</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+</head>
+<body class="bg-gray-100 p-8">
+    <div class="max-w-4xl mx-auto bg-white p-6 rounded-lg shadow-lg">
+        <h1 class="text-3xl font-bold mb-6">Change System Prompt</h1>
+        <form method="POST" class="space-y-4">
+            <div>
+                <label for="new_prompt" class="block text-sm font-medium text-gray-700 mb-2">Current System Prompt:</label>
+                <textarea name="new_prompt" id="new_prompt" rows="10" class="w-full p-3 border border-gray-300 rounded-md focus:ring-blue-500 focus:border-blue-500">{{ prompt }}</textarea>
+            </div>
+            <div class="space-x-4">
+                <button type="submit" class="bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded">Update Prompt</button>
+                <a href="/" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded inline-block">Cancel</a>
+            </div>
+        </form>
+    </div>
+</body>
+</html>
+""", autoescape=True)
+
+_PROMPT_UPDATED_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Prompt Updated</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+</head>
+<body class="bg-gray-100 p-8">
+    <div class="max-w-2xl mx-auto bg-white p-6 rounded-lg shadow-lg">
+        <h1 class="text-2xl font-bold text-green-600 mb-4">System Prompt Updated Successfully!</h1>
+        <p class="mb-4">The new system prompt has been applied.</p>
+        <div class="space-x-4">
+            <a href="/" class="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded">Go to Home</a>
+            <a href="/change-prompt" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded">Change Prompt Again</a>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# --- Route to change system prompt ---
+@app.route('/change-prompt', methods=['GET', 'POST'])
+async def change_prompt():
+    """
+    Route to display and update the system prompt.
+    """
+    if request.method == 'POST':
+        form = await request.form
+        new_prompt = form.get('new_prompt')
+        if new_prompt:
+            await asyncio.to_thread(set_system_prompt, new_prompt)
+            return _PROMPT_UPDATED_HTML
+    
+    # GET request - show the form
+    return _PROMPT_FORM_TEMPLATE.render(prompt=refresh_system_prompt())
+
+# --- Page Prompt ---
+def build_page_prompt(path):
+    """
+    Builds the LLM prompt for a URL path.
+
+    Args:
+        path (str): The URL path, without the leading slash.
+
+    Returns:
+        tuple[str, str]: The page name and the prompt describing the page.
+    """
+    # If the path is empty, it's the home page.
+    if not path:
+        page_name = "home"
+    else:
+        # Use the path to create a more descriptive page name.
+        # e.g., "products/laptops" becomes "products laptops"
+        page_name = path.replace('/', ' ').replace('_', ' ')
+
+    # --- Prompt Engineering ---
+    # This is where you craft the prompt for the LLM.
+    # A more sophisticated app might have different prompt templates for different types of pages.
+    prompt = f"""Generate the HTML for a page about '{page_name}'. The page should have a clean and modern design. 
+    Make the content interesting and relevant to the topic. If it's a product, include a price and a buy button. 
+    If it's a blog post, make it informative. 
+    
+    IMPORTANT: Include the following navigation elements:
+    - A navigation bar with links to: /about, /products, /blog, /contact
+    - A "Change System Prompt" button that links to /change-prompt
+    - At least 3 clickable buttons that lead to different pages (be creative with the links)
+    - Make sure all buttons and links are properly styled with Tailwind CSS
+    - Include hover effects on all interactive elements
+    
+    The page should feel like a real website with functional navigation."""
+
+    return page_name, prompt
+
+# --- The "Catch-All" Route ---
+@app.route('/', defaults={'path': ''})
+@app.route('/<path:path>')
+async def catch_all(path):
+    """
+    This function handles all incoming requests.
+    It generates a prompt based on the URL path and races the providers for the HTML.
+    """
+    page_name, prompt = build_page_prompt(path)
+
+    print(f"Generating page for path: /{path}")
+    print(f"Generated prompt: {prompt}")
+
+    # Generate the HTML with whichever LLM answers first
+    html_content = await generate_html_with_fastest_llm(prompt)
+
+    # Return the generated HTML as the response
+    return Response(html_content, mimetype='text/html')
+
+# --- Running the Application ---
+if __name__ == '__main__':
+    # To run this application:
+    # 1. Make sure you have the dependencies installed:
+    #    pip install -r requirements.txt
+    # 2. Set the API keys of the providers to race (GOOGLE_API_KEY, GROQ_API_KEY,
+    #    INCEPTION_API_KEY). Providers without a key are left out.
+    # 3. Run this script:
+    #    python main.py
+    # 4. Open your web browser and navigate to http://127.0.0.1:5000
+    #    Try different URLs like:
+    #    - http://127.0.0.1:5000/about_us
+    #    - http://127.0.0.1:5000/products/vintage_cameras
+    #    - http://127.0.0.1:5000/blog/the_future_of_ai
+    
+    # For production, serve the app with uvicorn (or gunicorn with uvicorn workers) instead:
+    #    uvicorn app-fastest:app --loop uvloop --http httptools --workers 4
+    #    gunicorn -k uvicorn.workers.UvicornWorker -w 4 --timeout 120 app-fastest:app
+    
+    # The API key check is now at the top of the script.
+    # The debugger and reloader are only turned on for local development (APP_ENV=dev).
+    # Quart runs the reloader whatever debug is set to, so it is switched off explicitly.
+    dev = os.environ.get("APP_ENV") == "dev"
+    app.run(debug=dev, use_reloader=dev, port=int(os.environ.get("PORT", "5001")))
+
@@ -1,7 +1,25 @@
 # main.py
+import asyncio
+import gzip
+import hashlib
+from html import escape
+import itertools
+import json
 import os
-from groq import Groq
-from flask import Flask, request, Response
+import re
+import sqlite3
+import threading
+import time
+import click
+from groq import AsyncGroq
+import httpx
+from jinja2 import Template
+from quart import Quart, request, Response
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # --- Configuration ---
 # IMPORTANT: Set your Groq API key as an environment variable.
@@ -10,7 +28,7 @@ from flask import Flask, request, Response
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 
 # Initialize the Groq client
-client = Groq(api_key=GROQ_API_KEY)
+client = AsyncGroq(api_key=GROQ_API_KEY)
 
 # The API key should always be available (either from env var or fallback)
 if not GROQ_API_KEY or GROQ_API_KEY == "":
@@ -21,11 +39,24 @@ else:
 print(f"Groq API key configured: {GROQ_API_KEY[:10]}...{GROQ_API_KEY[-4:]}")
 
 
-# Initialize the Flask app
-app = Flask(__name__)
+# The model used to generate every page
+MODEL_NAME = "qwen2.5-72b-instruct"
+
+# Sent unchanged with every request so providers can reuse the cached prefix
+_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are an elite UI/UX architect. Generate ONLY complete, functional HTML code. Do not include any explanations, comments, or text before/after the HTML. Start directly with <!DOCTYPE html> and end with </html>. No markdown formatting."
+}
+
+# Initialize the Quart app
+app = Quart(__name__)
+# Quart stops sending a response body after RESPONSE_TIMEOUT (60s by default)
+# without logging anything, which would cut off a slow streamed page and keep
+# it out of the cache. The LLM clients carry their own timeouts instead.
+app.config["RESPONSE_TIMEOUT"] = None
 
-# Global variable to store the current system prompt
-current_system_prompt = (
+# The system prompt used until a new one is set through /change-prompt
+DEFAULT_SYSTEM_PROMPT = (
     "You are an elite UI/UX architect and full-stack developer specializing in cutting-edge web experiences. "
     "Create stunning, modern HTML pages that push the boundaries of web design. Your output must be:"
     "\n\n🎨 VISUAL EXCELLENCE:"
@@ -55,125 +86,593 @@ current_system_prompt = (
     "Make every page feel like a premium, modern web application."
 )
 
+# --- System Prompt Store ---
+# The current system prompt lives in a one-element list, so replacing or reading
+# _prompt_holder[0] is a single atomic step that needs no lock. Updates are also
+# written to a small SQLite database, which lets the other worker processes
+# (and the next restart) pick them up; the database is only read again after
+# another worker has written to it. WAL mode lets the workers read
+# it while one of them writes.
+SITE_DB = os.environ.get("SITE_DB", "site.db")
+_DB = sqlite3.connect(SITE_DB, isolation_level=None, check_same_thread=False)
+_DB.execute("PRAGMA journal_mode=WAL")
+_DB.execute("CREATE TABLE IF NOT EXISTS settings (k TEXT PRIMARY KEY, v TEXT)")
+_db_lock = threading.Lock()
+# Writes go through a connection of their own, so a write waiting on another
+# worker's never holds _db_lock and stalls the reads requests make on _DB
+_WRITE_DB = sqlite3.connect(SITE_DB, isolation_level=None, check_same_thread=False)
+_write_lock = threading.Lock()
+_PROMPT_SETTING = f"system_prompt:{MODEL_NAME}"
+_prompt_holder = [DEFAULT_SYSTEM_PROMPT]
+# PRAGMA data_version changes whenever another connection commits to the database
+_db_version = [None]
+
+
+def refresh_system_prompt():
+    """Picks up a system prompt set by another worker and returns the current one."""
+    with _db_lock:
+        (version,) = _DB.execute("PRAGMA data_version").fetchone()
+        if version != _db_version[0]:
+            _db_version[0] = version
+            row = _DB.execute("SELECT v FROM settings WHERE k = ?", (_PROMPT_SETTING,)).fetchone()
+            if row is not None:
+                _prompt_holder[0] = row[0]
+    return _prompt_holder[0]
+
+
+def set_system_prompt(prompt):
+    """Replaces the system prompt for this worker and every other one."""
+    _prompt_holder[0] = prompt
+    with _write_lock:
+        _WRITE_DB.execute("INSERT OR REPLACE INTO settings (k, v) VALUES (?, ?)", (_PROMPT_SETTING, prompt))
+
+
+refresh_system_prompt()
+
+# --- Response Cache ---
+# A page is deterministic given the model, the system prompt and the page
+# prompt, so repeat visits are served from memory instead of another LLM call.
+# Each entry keeps the HTML next to a gzip copy compressed once on insert.
+# Pages are also stored in the site database, so they survive restarts and are
+# shared between workers; memory only holds the most recently used ones.
+CACHE_MAX_ENTRIES = 1024
+CACHE_DB_MAX_ENTRIES = 10000
+# Browsers and CDNs may keep a generated page for an hour
+PAGE_CACHE_CONTROL = "public, max-age=3600"
+_cache: dict[bytes, tuple[str, bytes]] = {}
+_cache_lock = threading.Lock()
+_DB.execute("CREATE TABLE IF NOT EXISTS pages (k BLOB PRIMARY KEY, html BLOB, gz BLOB, ts REAL)")
+_DB.execute("CREATE INDEX IF NOT EXISTS pages_ts ON pages (ts)")
+
+
+def _cache_key(system_prompt, page_prompt):
+    """Returns the cache key for a page prompt under a system prompt."""
+    raw = "\0".join((MODEL_NAME, system_prompt, page_prompt))
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+
+def _page_cache_headers(key):
+    """
+    Returns the HTTP caching headers for the page stored under a cache key.
+
+    The ETag is derived from the cache key rather than the HTML, so a
+    conditional request can be answered without looking the page up. It is
+    weak because any page generated for the key is an equivalent answer.
+    """
+    return {"ETag": f'W/"{key.hex()}"', "Cache-Control": PAGE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+
+def _compress_page(html):
+    """Returns a cache entry holding the page and its gzip-compressed bytes."""
+    return html, gzip.compress(html.encode(), compresslevel=6)
+
+
+def _cache_remember(key, page):
+    """Keeps a page entry in memory, evicting the oldest entries once the cache is full."""
+    with _cache_lock:
+        _cache[key] = page
+        # Dicts keep insertion order, so the first key is the oldest entry
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            del _cache[next(iter(_cache))]
+
+
+def _cache_get(key):
+    """Returns the page entry stored under a key, or None if the page is not cached."""
+    with _cache_lock:
+        page = _cache.get(key)
+    if page is not None:
+        return page
+    
+    # Another worker or an earlier run may have generated the page
+    with _db_lock:
+        row = _DB.execute("SELECT html, gz FROM pages WHERE k = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    page = row[0].decode(), row[1]
+    _cache_remember(key, page)
+    return page
+
+
+def _cache_store(key, page):
+    """Writes a page entry to the site database, dropping the oldest rows over the cap."""
+    html, gzipped_html = page
+    with _write_lock:
+        _WRITE_DB.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (key, html.encode(), gzipped_html, time.time()))
+        (count,) = _WRITE_DB.execute("SELECT COUNT(*) FROM pages").fetchone()
+        if count > CACHE_DB_MAX_ENTRIES:
+            _WRITE_DB.execute(
+                "DELETE FROM pages WHERE k IN (SELECT k FROM pages ORDER BY ts LIMIT ?)",
+                (count - CACHE_DB_MAX_ENTRIES,),
+            )
+
+
+async def _cache_put(key, page):
+    """Stores a page entry in memory and in the site database."""
+    _cache_remember(key, page)
+    # The write may wait on another worker's, so it stays off the event loop
+    try:
+        await asyncio.to_thread(_cache_store, key, page)
+    except sqlite3.Error as e:
+        # The page is still served from memory by this worker
+        print(f"Could not store the page in the site database: {e}")
+
+# --- Semantic Cache ---
+# Near-duplicate routes such as /about_us and /about-us would otherwise each
+# cost a full LLM call. Page names are embedded by the shared embedding service
+# (embed-service.py) and a cached page is reused when its name is similar
+# enough. Skipped unless EMBED_SERVICE_URL is set and numpy is installed.
+EMBED_SERVICE_URL = os.environ.get("EMBED_SERVICE_URL", "")
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+SEMANTIC_CACHE_MAX_ENTRIES = 2048
+
+if EMBED_SERVICE_URL and np is not None:
+    _EMBED_HTTP = httpx.AsyncClient(base_url=EMBED_SERVICE_URL, timeout=5.0)
+    # Embeddings live in one preallocated, contiguous float32 block, so a lookup
+    # is a single BLAS matrix-vector product over the filled rows
+    _semantic_embeds = np.empty((SEMANTIC_CACHE_MAX_ENTRIES, EMBEDDING_DIM), dtype=np.float32)
+    _semantic_last_used = np.zeros(SEMANTIC_CACHE_MAX_ENTRIES, dtype=np.int64)
+else:
+    _EMBED_HTTP = None
+    print("Semantic cache disabled: set EMBED_SERVICE_URL and install numpy to enable it.")
+
+_semantic_pages: list[tuple[str, bytes]] = []
+_semantic_count = 0
+# Every entry was generated under this system prompt. Another worker may change
+# the prompt, so lookups under any other prompt miss and the next insert starts over.
+_semantic_prompt = None
+_semantic_clock = itertools.count(1)
+_semantic_lock = threading.Lock()
+
+
+@app.after_serving
+async def close_embed_client():
+    """Closes the connections to the embedding service when the server shuts down."""
+    if _EMBED_HTTP is not None:
+        await _EMBED_HTTP.aclose()
+
+
+async def _embed(page_name):
+    """Returns the normalized embedding of a page name, or None if it is unavailable."""
+    if _EMBED_HTTP is None:
+        return None
+    try:
+        response = await _EMBED_HTTP.post("/embed", json=page_name)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Embedding service request failed: {e}")
+        return None
+    query = np.frombuffer(response.content, dtype=np.float32)
+    if query.shape != (EMBEDDING_DIM,):
+        print(f"Embedding service returned {query.size} dimensions, expected {EMBEDDING_DIM}")
+        return None
+    return query
+
+
+def _semantic_get(system_prompt, query):
+    """Returns the cached page entry whose name is most similar to the query, if close enough."""
+    with _semantic_lock:
+        if not _semantic_count or system_prompt != _semantic_prompt:
+            return None
+        # Rows are normalized on insert, so the product gives every cosine similarity
+        sims = _semantic_embeds[:_semantic_count] @ query
+        best = int(sims.argmax())
+        if sims[best] <= SEMANTIC_CACHE_THRESHOLD:
+            return None
+        _semantic_last_used[best] = next(_semantic_clock)
+        return _semantic_pages[best]
+
+
+def _semantic_put(system_prompt, query, page):
+    """Stores a page entry under its name embedding, replacing the least recently used one when full."""
+    global _semantic_count, _semantic_prompt
+    with _semantic_lock:
+        if system_prompt != _semantic_prompt:
+            # Pages generated under the old prompt must not be served any more
+            _semantic_count = 0
+            _semantic_pages.clear()
+            _semantic_prompt = system_prompt
+        if _semantic_count < SEMANTIC_CACHE_MAX_ENTRIES:
+            slot = _semantic_count
+            _semantic_count += 1
+            _semantic_pages.append(page)
+        else:
+            slot = int(_semantic_last_used.argmin())
+            _semantic_pages[slot] = page
+        _semantic_embeds[slot] = query
+        _semantic_last_used[slot] = next(_semantic_clock)
+
+
+def _semantic_clear():
+    """Drops every entry from the semantic cache."""
+    global _semantic_count
+    with _semantic_lock:
+        _semantic_count = 0
+        _semantic_pages.clear()
+
+# --- Template Cache ---
+# Pages such as /products/laptops and /products/phones differ only in their
+# last word. A generated page is kept as a template with that word replaced by
+# slot markers, and a later request that changes only the last word is rendered
+# from the template instead of calling the LLM.
+TEMPLATE_MIN_CONFIDENCE = 0.9
+TEMPLATE_CACHE_MAX_ENTRIES = 256
+_SLOT_FORMS = (
+    ("{{SLOT}}", str.lower),
+    ("{{SLOT_TITLE}}", str.capitalize),
+    ("{{SLOT_UPPER}}", str.upper),
+)
+_templates: dict[bytes, str] = {}
+_templates_lock = threading.Lock()
+# Tags (with their attributes and URLs), scripts and styles
+_MARKUP = re.compile(r"<script\b.*?</script>|<style\b.*?</style>|<[^>]*>", re.IGNORECASE | re.DOTALL)
+# Link targets the prompts ask for, such as /about or /contact
+_LINK_TARGET = re.compile(r"(?<![\w/])/([a-z][\w-]*)", re.IGNORECASE)
+
+
+def _split_slot(page_name):
+    """Splits a page name into its fixed words and the trailing slot word, if it has both."""
+    words = page_name.lower().split()
+    if len(words) < 2:
+        return None, None
+    return " ".join(words[:-1]), words[-1]
+
+
+def _template_key(system_prompt, fixed_words):
+    """Returns the template cache key for the fixed words of a page name."""
+    raw = "\0".join((MODEL_NAME, system_prompt, fixed_words))
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+
+def _make_template(html, word):
+    """
+    Replaces the occurrences of a word in a page with slot markers.
+
+    Args:
+        html (str): The generated page.
+        word (str): The lowercase slot word.
+
+    Returns:
+        str: The template, or None if the word shows up inside markup, or if
+        fewer than TEMPLATE_MIN_CONFIDENCE of the occurrences are standalone
+        words in lower, capitalized or upper case.
+    """
+    total = html.lower().count(word)
+    if not total:
+        return None
+    
+    # Only text may change; a link or attribute naming the word would point
+    # every page rendered from the template at the wrong place
+    if any(word in markup.lower() for markup in _MARKUP.findall(html)):
+        return None
+    
+    markers = {convert(word): marker for marker, convert in _SLOT_FORMS}
+    replaced = 0
+    
+    def to_marker(match):
+        nonlocal replaced
+        marker = markers.get(match.group())
+        if marker is None:
+            return match.group()
+        replaced += 1
+        return marker
+    
+    template = re.sub(rf"(?<!\w){re.escape(word)}(?!\w)", to_marker, html, flags=re.IGNORECASE)
+    if replaced / total < TEMPLATE_MIN_CONFIDENCE:
+        return None
+    return template
+
+
+def _template_put(system_prompt, page_name, page_prompt, html):
+    """Stores a generated page as a template for pages that differ only in the last word."""
+    fixed_words, word = _split_slot(page_name)
+    if word is None:
+        return
+    # The pages the prompts link to, such as /contact, are always fixed
+    link_targets = {target.lower() for target in _LINK_TARGET.findall(system_prompt + page_prompt)}
+    if word in link_targets:
+        return
+    template = _make_template(html, word)
+    if template is None:
+        return
+    with _templates_lock:
+        _templates[_template_key(system_prompt, fixed_words)] = template
+        while len(_templates) > TEMPLATE_CACHE_MAX_ENTRIES:
+            del _templates[next(iter(_templates))]
+
+
+def _template_get(system_prompt, page_name):
+    """Renders a page from a cached template sharing its fixed words, if there is one."""
+    fixed_words, word = _split_slot(page_name)
+    if word is None:
+        return None
+    with _templates_lock:
+        template = _templates.get(_template_key(system_prompt, fixed_words))
+    if template is None:
+        return None
+    # The word comes straight from the URL, so it is escaped like any other text
+    for marker, convert in _SLOT_FORMS:
+        template = template.replace(marker, escape(convert(word)))
+    return template
+
+# --- HTML Cleanup ---
+def _strip_to_html(text):
+    """
+    Strips any explanatory text before the HTML and any markdown fences.
+
+    Args:
+        text (str): Raw text produced by the model.
+
+    Returns:
+        str: The cleaned HTML.
+    """
+    # Find where the document starts and slice once, instead of splitting and rejoining
+    start = text.find('<!DOCTYPE')
+    if start < 0:
+        start = text.find('<html')
+    if start > 0:
+        text = text[start:]
+    
+    # Only walk the text again when there is a fence to remove
+    if '`' in text:
+        text = text.replace('```html', '').replace('```', '')
+    
+    return text
+
+
+async def _clean_html_stream(chunks):
+    """
+    Cleans streamed model output the same way _strip_to_html cleans a full response.
+
+    Text is buffered until the start of the HTML document shows up, then passed
+    through as it arrives with markdown fences removed.
+
+    Args:
+        chunks: An async iterator of raw text chunks from the model.
+
+    Yields:
+        str: Chunks of cleaned HTML.
+    """
+    buffer = ''
+    started = False
+    async for chunk in chunks:
+        buffer += chunk
+        if not started:
+            if '<!DOCTYPE' not in buffer and '<html' not in buffer:
+                continue
+            started = True
+            buffer = _strip_to_html(buffer)
+        # Hold back trailing backticks in case a fence is split across chunks
+        ready = buffer.rstrip('`')
+        buffer = buffer[len(ready):]
+        ready = ready.replace('```html', '').replace('```', '')
+        if ready:
+            yield ready
+    
+    # Flush what is left, cleaning the whole response if no HTML was ever found
+    rest = buffer.replace('```', '') if started else _strip_to_html(buffer.strip())
+    if rest:
+        yield rest
+
+
 # --- Helper Function for LLM Interaction ---
-def generate_html_with_llm(page_prompt):
+# Pages being generated right now, so concurrent requests for the same page
+# share one LLM call. Everything runs on the event loop, so no lock is needed.
+_inflight: dict[bytes, asyncio.Future] = {}
+
+
+async def generate_html_with_llm(system_prompt, page_prompt, page_name):
     """
     Sends a prompt to Groq's Qwen model to generate HTML.
 
     Args:
+        system_prompt (str): The system prompt the request was keyed under.
         page_prompt (str): The prompt describing the page to generate.
+        page_name (str): The short page name, used to find similar cached pages.
 
-    Returns:
-        str: The generated HTML content, or an error message.
+    Yields:
+        str: Chunks of the generated HTML content, or an error message.
     """
+    key = _cache_key(system_prompt, page_prompt)
+    cached_page = _cache_get(key)
+    if cached_page is not None:
+        print("Serving page from cache")
+        yield cached_page[0]
+        return
+
+    # Wait for a concurrent request that is already generating this page instead
+    # of making an identical LLM call. If it fails, the next waiter takes over.
+    while key in _inflight:
+        # Shielded, so a waiter that disconnects does not cancel the shared result
+        html = await asyncio.shield(_inflight[key])
+        if html is not None:
+            print("Serving page generated for a concurrent request")
+            yield html
+            return
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        async for html_chunk in _generate_page(system_prompt, key, page_prompt, page_name):
+            yield html_chunk
+    finally:
+        del _inflight[key]
+        # Every path that produces a page caches it under the key
+        cached_page = _cache_get(key)
+        future.set_result(cached_page[0] if cached_page is not None else None)
+
+
+async def _generate_page(system_prompt, key, page_prompt, page_name):
+    """
+    Finds a similar cached page or generates a new one with Groq, caching the result.
+
+    Yields:
+        str: Chunks of the generated HTML content, or an error message.
+    """
+    query = await _embed(page_name)
+    if query is not None:
+        similar_page = _semantic_get(system_prompt, query)
+        if similar_page is not None:
+            print("Serving similar page from semantic cache")
+            await _cache_put(key, similar_page)
+            yield similar_page[0]
+            return
+
+    template_html = _template_get(system_prompt, page_name)
+    if template_html is not None:
+        print("Serving page rendered from a cached template")
+        await _cache_put(key, _compress_page(template_html))
+        yield template_html
+        return
+
     try:
         # Prepare the full prompt with system instructions
         full_prompt = (
-            current_system_prompt +
+            system_prompt +
             f"\n\n---USER REQUEST---\n{page_prompt}"
         )
         
         # Generate content using Groq with advanced Qwen model
-        chat_completion = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are an elite UI/UX architect. Generate ONLY complete, functional HTML code. Do not include any explanations, comments, or text before/after the HTML. Start directly with <!DOCTYPE html> and end with </html>. No markdown formatting."
-                },
+                _SYSTEM_MESSAGE,
                 {
                     "role": "user",
                     "content": full_prompt,
                 }
             ],
-            model="qwen2.5-72b-instruct",
+            model=MODEL_NAME,
             max_tokens=4000,
-            temperature=0.8
+            temperature=0.8,
+            stream=True
         )
         
-        # Extract the generated HTML
-        generated_html = chat_completion.choices[0].message.content.strip()
-        
-        # Clean up any unwanted text or markdown
-        generated_html = generated_html.replace('```html', '').replace('```', '')
+        async def text_chunks():
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
         
-        # Remove any explanatory text before HTML
-        if '<!DOCTYPE html>' in generated_html:
-            generated_html = '<!DOCTYPE html>' + generated_html.split('<!DOCTYPE html>', 1)[1]
-        elif '<html' in generated_html:
-            generated_html = '<html' + generated_html.split('<html', 1)[1]
-        
-        return generated_html
+        # Pass the HTML through as it arrives and keep a copy for the cache
+        html_parts = []
+        async for html_chunk in _clean_html_stream(text_chunks()):
+            html_parts.append(html_chunk)
+            yield html_chunk
+        generated_html = ''.join(html_parts)
 
     except Exception as e:
         print(f"An unexpected error occurred with the Groq API: {e}")
-        return f"<h1>Error: Could not connect to the Groq API</h1><p>{e}</p>"
+        yield f"<h1>Error: Could not connect to the Groq API</h1><p>{e}</p>"
+        return
+    
+    # Cached outside the API error handling, since the page has already been sent
+    page = _compress_page(generated_html)
+    await _cache_put(key, page)
+    if query is not None:
+        _semantic_put(system_prompt, query, page)
+    _template_put(system_prompt, page_name, page_prompt, generated_html)
 
 
+# --- Change Prompt Pages ---
+# The form is compiled once; autoescaping keeps a prompt containing markup such
+# as </textarea> from breaking out of the text box.
+_PROMPT_FORM_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>Change System Prompt</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+</head>
+<body class="bg-gray-100 p-8">
+    <div class="max-w-4xl mx-auto bg-white p-6 rounded-lg shadow-lg">
+        <h1 class="text-3xl font-bold mb-6">Change System Prompt</h1>
+        <form method="POST" class="space-y-4">
+            <div>
+                <label for="new_prompt" class="block text-sm font-medium text-gray-700 mb-2">Current System Prompt:</label>
+                <textarea name="new_prompt" id="new_prompt" rows="10" class="w-full p-3 border border-gray-300 rounded-md focus:ring-blue-500 focus:border-blue-500">{{ prompt }}</textarea>
+            </div>
+            <div class="space-x-4">
+                <button type="submit" class="bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded">Update Prompt</button>
+                <a href="/" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded inline-block">Cancel</a>
+            </div>
+        </form>
+    </div>
+</body>
+</html>
+""", autoescape=True)
+
+_PROMPT_UPDATED_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Prompt Updated</title>
+    <script src="https://cdn.tailwindcss.com"></script>
+</head>
+<body class="bg-gray-100 p-8">
+    <div class="max-w-2xl mx-auto bg-white p-6 rounded-lg shadow-lg">
+        <h1 class="text-2xl font-bold text-green-600 mb-4">System Prompt Updated Successfully!</h1>
+        <p class="mb-4">The new system prompt has been applied.</p>
+        <div class="space-x-4">
+            <a href="/" class="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded">Go to Home</a>
+            <a href="/change-prompt" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded">Change Prompt Again</a>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
 # --- Route to change system prompt ---
 @app.route('/change-prompt', methods=['GET', 'POST'])
-def change_prompt():
+async def change_prompt():
     """
     Route to display and update the system prompt.
     """
-    global current_system_prompt
-    
     if request.method == 'POST':
-        new_prompt = request.form.get('new_prompt')
+        form = await request.form
+        new_prompt = form.get('new_prompt')
         if new_prompt:
-            current_system_prompt = new_prompt
-            return f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Prompt Updated</title>
-                <script src="https://cdn.tailwindcss.com"></script>
-            </head>
-            <body class="bg-gray-100 p-8">
-                <div class="max-w-2xl mx-auto bg-white p-6 rounded-lg shadow-lg">
-                    <h1 class="text-2xl font-bold text-green-600 mb-4">System Prompt Updated Successfully!</h1>
-                    <p class="mb-4">The new system prompt has been applied.</p>
-                    <div class="space-x-4">
-                        <a href="/" class="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded">Go to Home</a>
-                        <a href="/change-prompt" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded">Change Prompt Again</a>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            await asyncio.to_thread(set_system_prompt, new_prompt)
+            # Every cached page was generated under the old prompt. Pages in the
+            # site database are keyed by prompt and model, so they are left to
+            # age out instead of being deleted for every app sharing it.
+            with _cache_lock:
+                _cache.clear()
+            _semantic_clear()
+            with _templates_lock:
+                _templates.clear()
+            return _PROMPT_UPDATED_HTML
     
     # GET request - show the form
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Change System Prompt</title>
-        <script src="https://cdn.tailwindcss.com"></script>
-    </head>
-    <body class="bg-gray-100 p-8">
-        <div class="max-w-4xl mx-auto bg-white p-6 rounded-lg shadow-lg">
-            <h1 class="text-3xl font-bold mb-6">Change System Prompt</h1>
-            <form method="POST" class="space-y-4">
-                <div>
-                    <label for="new_prompt" class="block text-sm font-medium text-gray-700 mb-2">Current System Prompt:</label>
-                    <textarea name="new_prompt" id="new_prompt" rows="10" class="w-full p-3 border border-gray-300 rounded-md focus:ring-blue-500 focus:border-blue-500">{current_system_prompt}</textarea>
-                </div>
-                <div class="space-x-4">
-                    <button type="submit" class="bg-green-500 hover:bg-green-700 text-white font-bold py-2 px-4 rounded">Update Prompt</button>
-                    <a href="/" class="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded inline-block">Cancel</a>
-                </div>
-            </form>
-        </div>
-    </body>
-    </html>
-    """
+    return _PROMPT_FORM_TEMPLATE.render(prompt=refresh_system_prompt())
 
-# --- The "Catch-All" Route ---
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def catch_all(path):
+# --- Page Prompt ---
+def build_page_prompt(path):
     """
-    This function handles all incoming requests.
-    It generates a prompt based on the URL path and gets the HTML from the LLM.
+    Builds the LLM prompt for a URL path.
+
+    Args:
+        path (str): The URL path, without the leading slash.
+
+    Returns:
+        tuple[str, str]: The page name and the prompt describing the page.
     """
     # If the path is empty, it's the home page.
     if not path:
@@ -223,20 +722,211 @@ def catch_all(path):
     
     Make this the most impressive, modern TUI experience possible!"""
 
+    return page_name, prompt
+
+# --- The "Catch-All" Route ---
+@app.route('/', defaults={'path': ''})
+@app.route('/<path:path>')
+async def catch_all(path):
+    """
+    This function handles all incoming requests.
+    It generates a prompt based on the URL path and gets the HTML from the LLM.
+    """
+    page_name, prompt = build_page_prompt(path)
+    # The prompt is read once, so the ETag and the generated page always agree
+    system_prompt = refresh_system_prompt()
+    key = _cache_key(system_prompt, prompt)
+
+    # The browser already holds a page for this exact request
+    if request.if_none_match.contains_weak(key.hex()):
+        return Response(status=304, headers=_page_cache_headers(key))
+
     print(f"Generating page for path: /{path}")
     print(f"Generated prompt: {prompt}")
 
-    # Generate the HTML using the LLM
-    html_content = generate_html_with_llm(prompt)
+    # Only complete cached pages are marked cacheable, never a stream that may still fail
+    cached_page = _cache_get(key)
+    if cached_page is not None:
+        print("Serving page from cache")
+        html, gzipped_html = cached_page
+        headers = _page_cache_headers(key)
+        if request.accept_encodings.quality('gzip') > 0:
+            headers["Content-Encoding"] = "gzip"
+            return Response(gzipped_html, mimetype='text/html', headers=headers)
+        return Response(html, mimetype='text/html', headers=headers)
+
+    # Stream the generated HTML back as the LLM produces it
+    return Response(generate_html_with_llm(system_prompt, prompt, page_name), mimetype='text/html')
+
+# --- Cache Warm-Up ---
+# Set WARM_CACHE_PATHS to a file listing one URL path per line to generate
+# those pages in the background when the server starts, so the first visitors
+# are already served from the cache.
+# Groq's Batch API generates them at a discount to live requests.
+WARM_CACHE_PATHS = os.environ.get("WARM_CACHE_PATHS", "")
+# An unfinished warm-up claim this old belongs to a worker that died, so it is taken over
+WARM_CACHE_CLAIM_SECONDS = 24 * 60 * 60
+WARM_CACHE_POLL_SECONDS = 30
+_BATCH_DONE_STATES = {"completed", "failed", "expired", "cancelled"}
 
-    # Return the generated HTML as the response
-    return Response(html_content, mimetype='text/html')
+
+def _read_warm_paths(filename):
+    """Returns the URL paths listed in a file, skipping blank lines and # comments."""
+    with open(filename) as f:
+        lines = [line.strip() for line in f]
+    return [line.lstrip('/') for line in lines if line and not line.startswith('#')]
+
+
+def _claim_warm_up(system_prompt, paths):
+    """
+    Returns the claim for the one worker that should warm the cache for these paths.
+
+    Every worker process runs before_serving, so the first one to record the
+    warm-up in the site database takes it and the others get None. A claim
+    covers one system prompt and path list. It is marked done once every page
+    is cached and dropped when the warm-up fails, so the next start retries;
+    use the warm-cache command to warm the same pages again on demand.
+    """
+    raw = "\0".join((MODEL_NAME, system_prompt, *paths))
+    claim = f"warm_cache:{hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()}"
+    now = time.time()
+    with _write_lock:
+        _WRITE_DB.execute(
+            "DELETE FROM settings WHERE k = ? AND v != 'done' AND CAST(v AS REAL) < ?",
+            (claim, now - WARM_CACHE_CLAIM_SECONDS),
+        )
+        cursor = _WRITE_DB.execute("INSERT OR IGNORE INTO settings (k, v) VALUES (?, ?)", (claim, str(now)))
+    return claim if cursor.rowcount == 1 else None
+
+
+def _finish_warm_up(claim, succeeded):
+    """Marks a warm-up claim done, or drops it so the next start tries again."""
+    with _write_lock:
+        if succeeded:
+            _WRITE_DB.execute("UPDATE settings SET v = 'done' WHERE k = ?", (claim,))
+        else:
+            _WRITE_DB.execute("DELETE FROM settings WHERE k = ?", (claim,))
+
+
+async def _cache_warm_page(key, system_prompt, page_name, page_prompt, text):
+    """Cleans a batch result and caches it the same way a live generation is cached."""
+    html = _strip_to_html(text.strip())
+    page = _compress_page(html)
+    await _cache_put(key, page)
+    query = await _embed(page_name)
+    if query is not None:
+        _semantic_put(system_prompt, query, page)
+    _template_put(system_prompt, page_name, page_prompt, html)
+
+
+async def warm_cache(paths):
+    """
+    Generates the pages for the given paths with Groq's Batch API and caches them.
+
+    Args:
+        paths (list[str]): URL paths, without the leading slash.
+    """
+    try:
+        system_prompt = refresh_system_prompt()
+        # Pages kept in the site database from an earlier run are not generated again
+        pages = [
+            (page_name, page_prompt)
+            for page_name, page_prompt in map(build_page_prompt, paths)
+            if _cache_get(_cache_key(system_prompt, page_prompt)) is None
+        ]
+        if not pages:
+            print("Every warm-up page is already cached")
+            return
+        keys = [_cache_key(system_prompt, page_prompt) for _, page_prompt in pages]
+        
+        # The Batch API reads its requests from an uploaded JSONL file
+        requests_jsonl = "\n".join(
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL_NAME,
+                    "messages": [
+                        _SYSTEM_MESSAGE,
+                        {"role": "user", "content": system_prompt + f"\n\n---USER REQUEST---\n{page_prompt}"},
+                    ],
+                    "max_tokens": 4000,
+                    "temperature": 0.8,
+                },
+            })
+            for i, (_, page_prompt) in enumerate(pages)
+        )
+        batch_file = await client.files.create(file=("warm-cache.jsonl", requests_jsonl.encode()), purpose="batch")
+        batch = await client.batches.create(
+            completion_window="24h",
+            endpoint="/v1/chat/completions",
+            input_file_id=batch_file.id,
+        )
+        print(f"Submitted batch {batch.id} to warm {len(pages)} pages")
+        
+        while batch.status not in _BATCH_DONE_STATES:
+            await asyncio.sleep(WARM_CACHE_POLL_SECONDS)
+            batch = await client.batches.retrieve(batch.id)
+        if batch.status != "completed" or not batch.output_file_id:
+            print(f"Batch {batch.id} finished with status {batch.status}")
+            return
+        
+        output = await client.files.content(batch.output_file_id)
+        for line in (await output.text()).splitlines():
+            result = json.loads(line)
+            i = int(result["custom_id"])
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                print(f"Batch request for '{pages[i][0]}' failed: {result.get('error')}")
+                continue
+            await _cache_warm_page(keys[i], system_prompt, *pages[i], response["body"]["choices"][0]["message"]["content"])
+        print(f"Cache warm-up finished for {len(pages)} pages")
+
+    except Exception as e:
+        print(f"Cache warm-up with the Groq Batch API failed: {e}")
+
+
+async def _warm_cache_claimed(claim, system_prompt, paths):
+    """Warms the cache for a claimed warm-up and records whether every page got cached."""
+    try:
+        await warm_cache(paths)
+    finally:
+        # Also runs when the server stops mid-warm-up, so the claim is not left behind
+        succeeded = all(
+            _cache_get(_cache_key(system_prompt, build_page_prompt(path)[1])) is not None
+            for path in paths
+        )
+        if not succeeded:
+            print("Cache warm-up did not cache every page; it will be retried on the next start")
+        try:
+            _finish_warm_up(claim, succeeded)
+        except sqlite3.Error as e:
+            print(f"Could not record the cache warm-up result: {e}")
+
+
+@app.before_serving
+async def start_cache_warm_up():
+    """Starts warming the cache in the background when WARM_CACHE_PATHS is set."""
+    if WARM_CACHE_PATHS:
+        paths = _read_warm_paths(WARM_CACHE_PATHS)
+        system_prompt = refresh_system_prompt()
+        claim = await asyncio.to_thread(_claim_warm_up, system_prompt, paths)
+        if claim is not None:
+            app.add_background_task(_warm_cache_claimed, claim, system_prompt, paths)
+
+
+@app.cli.command("warm-cache")
+@click.option("--paths", "paths_file", required=True, type=click.Path(exists=True), help="File listing one URL path per line.")
+def warm_cache_command(paths_file):
+    """Generates the listed pages and stores them in the site database."""
+    asyncio.run(warm_cache(_read_warm_paths(paths_file)))
 
 # --- Running the Application ---
 if __name__ == '__main__':
     # To run this application:
-    # 1. Make sure you have Flask and Google's Generative AI library installed:
-    #    pip install Flask google-generativeai
+    # 1. Make sure you have the dependencies installed:
+    #    pip install -r requirements.txt
     # 2. Set your Google API key as an environment variable (GOOGLE_API_KEY).
     # 3. Run this script:
     #    python main.py
@@ -246,6 +936,13 @@ if __name__ == '__main__':
     #    - http://127.0.0.1:5000/products/vintage_cameras
     #    - http://127.0.0.1:5000/blog/the_future_of_ai
     
+    # For production, serve the app with uvicorn (or gunicorn with uvicorn workers) instead:
+    #    uvicorn app-groq:app --loop uvloop --http httptools --workers 4
+    #    gunicorn -k uvicorn.workers.UvicornWorker -w 4 --timeout 120 app-groq:app
+    
     # The API key check is now at the top of the script.
-    app.run(debug=True, port=5001)
+    # The debugger and reloader are only turned on for local development (APP_ENV=dev).
+    # Quart runs the reloader whatever debug is set to, so it is switched off explicitly.
+    dev = os.environ.get("APP_ENV") == "dev"
+    app.run(debug=dev, use_reloader=dev, port=int(os.environ.get("PORT", "5001")))
 
@@ -0,0 +1,93 @@
+# embed-service.py
+import asyncio
+import os
+import numpy as np
+import onnxruntime as ort
+from quart import Quart, request, Response
+from sentence_transformers import SentenceTransformer
+
+# --- Configuration ---
+# One process holds the embedding model for all three apps, so the weights are
+# loaded once instead of once per app. Point the apps at it with
+# EMBED_SERVICE_URL, e.g. export EMBED_SERVICE_URL='http://127.0.0.1:8765'
+EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBED_SERVICE_PORT = int(os.environ.get("EMBED_SERVICE_PORT", "8765"))
+MAX_BATCH_SIZE = 64
+
+# Run the model on ONNX Runtime. Swapping the provider (e.g. for
+# CUDAExecutionProvider) moves it to a GPU without touching the apps.
+_session_options = ort.SessionOptions()
+_session_options.inter_op_num_threads = 1
+model = SentenceTransformer(
+    EMBED_MODEL_NAME,
+    backend="onnx",
+    model_kwargs={"provider": "CPUExecutionProvider", "session_options": _session_options},
+)
+print(f"Loaded embedding model {EMBED_MODEL_NAME} ({model.get_sentence_embedding_dimension()} dimensions)")
+
+# Initialize the Quart app
+app = Quart(__name__)
+
+# --- Request Batching ---
+# Requests that arrive while the model is busy wait in a queue and are encoded
+# together in the next call, which costs about the same as encoding one.
+_queue = None
+
+
+async def _encode_batches():
+    """Encodes queued texts in batches and hands each caller its embedding."""
+    while True:
+        batch = [await _queue.get()]
+        while not _queue.empty() and len(batch) < MAX_BATCH_SIZE:
+            batch.append(_queue.get_nowait())
+
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = await asyncio.to_thread(model.encode, texts, normalize_embeddings=True)
+        except Exception as e:
+            print(f"Embedding a batch of {len(texts)} texts failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), embedding in zip(batch, embeddings):
+            # The caller may have disconnected while waiting
+            if not future.done():
+                future.set_result(embedding.astype(np.float32).tobytes())
+
+
+@app.before_serving
+async def start_batching():
+    """Starts the batch encoder once the event loop is running."""
+    global _queue
+    _queue = asyncio.Queue()
+    app.add_background_task(_encode_batches)
+
+
+# --- Embedding Route ---
+@app.route('/embed', methods=['POST'])
+async def embed():
+    """
+    Embeds a single text.
+
+    The request body is a JSON string. The response body is the L2-normalized
+    embedding as raw float32 bytes, ready for np.frombuffer.
+    """
+    text = await request.get_json()
+    if not isinstance(text, str):
+        return Response("Expected a JSON string", status=400)
+
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((text, future))
+    return Response(await future, mimetype='application/octet-stream')
+
+# --- Running the Application ---
+if __name__ == '__main__':
+    # To run the service:
+    # 1. Install its dependencies:
+    #    pip install numpy onnxruntime "sentence-transformers[onnx]" Quart
+    # 2. Run this script (a single process, so the model is loaded only once):
+    #    python embed-service.py
+    # 3. Start the apps with EMBED_SERVICE_URL=http://127.0.0.1:8765
+    app.run(port=EMBED_SERVICE_PORT)